@@ -0,0 +1,29 @@
+import os
+import uvicorn
+from app.core.config import settings
+
+def main():
+    """Run the API server"""
+    if settings.ENV == "prod":
+        uvicorn.run(
+            "app.main:app",
+            host="0.0.0.0",
+            port=8000,
+            workers=settings.WEB_CONCURRENCY or (os.cpu_count() or 1) * 2 + 1,
+            loop="uvloop",
+            http="httptools",
+            reload=False
+        )
+    else:
+        uvicorn.run(
+            "app.main:app",
+            host="0.0.0.0",
+            port=8000,
+            reload=True
+        )
+
+# Started as `python -m app`: spawned server and PDF worker processes skip
+# re-importing a package's __main__, so they never build the API services
+# just to start up
+if __name__ == "__main__":
+    main()
@@ -54,7 +54,7 @@ async def generate_mcqs(request: MCQRequest):
             )
 
         # Generate MCQs
-        response = course_service.generate_course_mcqs(
+        response = await course_service.generate_course_mcqs(
             course_code=request.course_code,
             num_questions=request.num_questions
         )
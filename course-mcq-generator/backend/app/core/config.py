@@ -19,6 +19,12 @@ class Settings(BaseSettings):
     GOOGLE_API_KEY: str = os.getenv("GOOGLE_API_KEY", "")
     GEMINI_MODEL: str = "gemini-2.5-pro"
     GEMINI_EMBEDDING_MODEL: str = "models/gemini-embedding-001"
+    MAX_INPUT_TOKENS: int = 8000
+
+    # Server Settings
+    ENV: str = "dev"
+    WEB_CONCURRENCY: int = 0  # Server worker processes (0 = 2 * CPU + 1 in prod)
+    PDF_WORKERS: int = 0  # PDF/OCR processes per server worker (0 = share of CPUs)
 
     # File Settings
     COURSE_PDF_DIR: str = "coursePdf"
@@ -27,6 +33,7 @@ class Settings(BaseSettings):
 
     # Vector Database Settings
     FAISS_INDEX_PATH: str = "faiss_index.bin"
+    CACHE_DIR: str = ".cache"
     CHUNK_SIZE: int = 1000
     CHUNK_OVERLAP: int = 200
 
@@ -0,0 +1,42 @@
+import logging
+import logging.handlers
+import queue
+from typing import Optional
+
+# Handler and listener installed by setup_logging, removed by shutdown_logging
+_queue_handler: Optional[logging.handlers.QueueHandler] = None
+_listener: Optional[logging.handlers.QueueListener] = None
+
+def setup_logging(level: int = logging.INFO) -> logging.handlers.QueueListener:
+    """Route root logging through a queue so request handlers never block on stream writes"""
+    global _queue_handler, _listener
+    if _listener is not None:
+        return _listener
+
+    log_queue = queue.Queue(-1)
+
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(
+        logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
+    )
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    _queue_handler = logging.handlers.QueueHandler(log_queue)
+    root.addHandler(_queue_handler)
+
+    # Background thread dispatching queued records to the stream handler
+    _listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    _listener.start()
+    return _listener
+
+def shutdown_logging():
+    """Flush queued records and detach the queue handler from the root logger"""
+    global _queue_handler, _listener
+    if _listener is None:
+        return
+
+    logging.getLogger().removeHandler(_queue_handler)
+    _listener.stop()
+    _queue_handler = None
+    _listener = None
@@ -1,15 +1,31 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import ORJSONResponse
 from app.api.routes import router
 from app.core.config import settings
-import uvicorn
+from app.core.logging_config import setup_logging, shutdown_logging
+from app.services.pdf_processor import shutdown_process_pool
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    setup_logging()
+    yield
+    shutdown_process_pool()
+    shutdown_logging()
 
 app = FastAPI(
     title="Course MCQ Generator API",
     description="Generate MCQs from course PDFs using Gemini LLM and RAG",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan
 )
 
+# Compress larger responses such as MCQ batches
+app.add_middleware(GZipMiddleware, minimum_size=1024, compresslevel=5)
+
 # Configure CORS
 app.add_middleware(
     CORSMiddleware,
@@ -31,9 +47,6 @@ async def health_check():
     return {"status": "healthy"}
 
 if __name__ == "__main__":
-    uvicorn.run(
-        "app.main:app",
-        host="0.0.0.0",
-        port=8000,
-        reload=True
-    )
\ No newline at end of file
+    # Prefer `python -m app`, which spawned worker processes do not re-import
+    from app.__main__ import main
+    main()
@@ -1,80 +1,111 @@
 import os
+import time
+import asyncio
+import logging
 from typing import List, Optional
 from datetime import datetime
 from app.core.config import settings
 from app.models.schemas import CourseInfo, MCQ, MCQResponse
-from app.services.pdf_processor import pdf_processor
+from app.services.pdf_processor import PDFProcessor, get_pdf_processor
 from app.services.embedding_service import embedding_service
 from app.services.mcq_generator import mcq_generator
 
+logger = logging.getLogger(__name__)
+
+# Seconds to reuse the course listing before rescanning the directory
+COURSES_CACHE_TTL = 10.0
+
 class CourseService:
     def __init__(self):
-        self.pdf_processor = pdf_processor
         self.embedding_service = embedding_service
         self.mcq_generator = mcq_generator
 
+        # Short-lived cache of the course listing
+        self._courses_cache: Optional[List[CourseInfo]] = None
+        self._courses_cached_at = 0.0
+
+    @property
+    def pdf_processor(self) -> PDFProcessor:
+        """PDF processor, created lazily on first access"""
+        return get_pdf_processor()
+
     def get_available_courses(self) -> List[CourseInfo]:
         """Get list of available courses"""
+        now = time.monotonic()
+        if self._courses_cache is not None and now - self._courses_cached_at < COURSES_CACHE_TTL:
+            return list(self._courses_cache)
+
         courses = []
 
         if not os.path.exists(settings.COURSE_PDF_DIR):
             return courses
 
-        for course_dir in os.listdir(settings.COURSE_PDF_DIR):
-            course_path = os.path.join(settings.COURSE_PDF_DIR, course_dir)
+        with os.scandir(settings.COURSE_PDF_DIR) as entries:
+            for entry in entries:
+                # Skip hidden directories such as the embedding cache
+                if entry.name.startswith('.'):
+                    continue
 
-            if os.path.isdir(course_path):
-                # Check if PDF exists
-                pdf_path = self.pdf_processor.find_course_pdf(course_dir)
+                if entry.is_dir(follow_symlinks=False):
+                    # Check if PDF exists
+                    pdf_path = self.pdf_processor.find_course_pdf(entry.name)
 
-                course_info = CourseInfo(
-                    course_code=course_dir,
-                    course_name=f"Course {course_dir}",  # You can enhance this
-                    pdf_exists=pdf_path is not None,
-                    pdf_path=pdf_path
-                )
-                courses.append(course_info)
+                    course_info = CourseInfo(
+                        course_code=entry.name,
+                        course_name=f"Course {entry.name}",  # You can enhance this
+                        pdf_exists=pdf_path is not None,
+                        pdf_path=pdf_path
+                    )
+                    courses.append(course_info)
+
+        self._courses_cache = courses
+        self._courses_cached_at = now
 
-        return courses
+        return list(courses)
 
     def validate_course(self, course_code: str) -> bool:
         """Validate if course exists and has PDF"""
         pdf_path = self.pdf_processor.find_course_pdf(course_code)
         return pdf_path is not None
 
-    def generate_course_mcqs(self, course_code: str, num_questions: int) -> MCQResponse:
+    async def generate_course_mcqs(self, course_code: str, num_questions: int) -> MCQResponse:
         """Generate MCQs for a specific course"""
         try:
-            # Validate course
-            if not self.validate_course(course_code):
+            # Process PDF to get text chunks (this also locates the course PDF)
+            logger.info("Processing PDF for course: %s", course_code)
+            try:
+                hashed_chunks = await self.pdf_processor.aprocess_course_pdf_hashed(course_code)
+            except FileNotFoundError:
                 raise ValueError(f"Course {course_code} not found or no PDF available")
 
-            # Process PDF to get text chunks
-            print(f"Processing PDF for course: {course_code}")
-            chunks = self.pdf_processor.process_course_pdf(course_code)
-
-            if not chunks:
+            if not hashed_chunks:
                 raise ValueError(f"No content extracted from course {course_code} PDF")
 
-            print(f"Extracted {len(chunks)} chunks from PDF")
+            # Cached chunk hashes key the vector store without re-hashing chunk text
+            chunk_hashes = [chunk_digest for chunk_digest, _ in hashed_chunks]
+            chunks = [chunk for _, chunk in hashed_chunks]
+
+            logger.info("Extracted %d chunks from PDF", len(chunks))
 
             # Get relevant context using embedding service
-            print("Getting relevant context for MCQ generation...")
-            relevant_context = self.embedding_service.get_relevant_context(chunks, num_questions)
+            logger.info("Getting relevant context for MCQ generation...")
+            relevant_context = await asyncio.to_thread(
+                self.embedding_service.get_relevant_context, chunks, num_questions, course_code, chunk_hashes
+            )
 
             if not relevant_context:
                 raise ValueError("No relevant context found for MCQ generation")
 
-            print(f"Using {len(relevant_context)} relevant chunks for MCQ generation")
+            logger.info("Using %d relevant chunks for MCQ generation", len(relevant_context))
 
             # Generate MCQs
-            print(f"Generating {num_questions} MCQs...")
-            mcqs = self.mcq_generator.generate_mcqs(relevant_context, num_questions)
+            logger.info("Generating %d MCQs...", num_questions)
+            mcqs = await self.mcq_generator.generate_mcqs(relevant_context, num_questions)
 
             if not mcqs:
                 raise ValueError("Failed to generate any valid MCQs")
 
-            print(f"Successfully generated {len(mcqs)} MCQs")
+            logger.info("Successfully generated %d MCQs", len(mcqs))
 
             # Create response
             response = MCQResponse(
@@ -1,9 +1,35 @@
 import os
+import logging
+import hashlib
+import functools
+import itertools
+import tempfile
+import orjson
 import numpy as np
 import faiss
-from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from app.core.config import settings
+from app.services.pdf_processor import chunk_hash
+
+logger = logging.getLogger(__name__)
+
+# Diverse queries used to retrieve comprehensive context for MCQ generation
+CONTEXT_QUERIES = [
+    "key concepts and definitions",
+    "important topics and theories",
+    "main principles and methods",
+    "fundamental concepts",
+    "important examples and applications"
+]
+
+# Texts per embedding request, and maximum requests in flight
+EMBEDDING_BATCH_SIZE = 32
+EMBEDDING_CONCURRENCY = 8
+
+# Bumped whenever the index layout or metric changes, invalidating cached indexes
+INDEX_VERSION = "ip1"
 
 class EmbeddingService:
     def __init__(self):
@@ -18,14 +44,81 @@ class EmbeddingService:
         self.index = None
         self.chunks = []
 
+        # On-disk cache of document embeddings keyed by sha256 of the text,
+        # one directory per model so vectors from different models never mix
+        self.model_tag = settings.GEMINI_EMBEDDING_MODEL.replace("/", "_")
+        self.cache_dir = os.path.join(settings.COURSE_PDF_DIR, ".emb_cache", self.model_tag)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        # Shared pool bounding concurrent embedding requests across callers
+        self._embed_pool = ThreadPoolExecutor(max_workers=EMBEDDING_CONCURRENCY)
+
+        # In-process memo for query embeddings
+        self._embed_query = functools.lru_cache(maxsize=4096)(self.embeddings.embed_query)
+
+        # Embeddings of CONTEXT_QUERIES, computed once on first use
+        self._query_matrix = None
+
+        # Vector stores loaded in this process as (cache key, index, chunks),
+        # one per course so a replaced PDF's store is dropped
+        self._stores: Dict[str, Tuple[str, faiss.Index, List[str]]] = {}
+        os.makedirs(settings.CACHE_DIR, exist_ok=True)
+
+    def _cache_path(self, text: str) -> str:
+        """Get the cache file path for a text"""
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, f"{digest}.npy")
+
+    def _load_or_miss(self, texts: List[str]) -> Tuple[List[Optional[np.ndarray]], List[int]]:
+        """Load cached embeddings and collect the indices of cache misses"""
+        vectors = []
+        misses = []
+
+        for i, text in enumerate(texts):
+            path = self._cache_path(text)
+            try:
+                vectors.append(np.load(path))
+            except (FileNotFoundError, ValueError, OSError):
+                vectors.append(None)
+                misses.append(i)
+
+        return vectors, misses
+
+    def _save_vector(self, text: str, vector: np.ndarray):
+        """Atomically write an embedding to the cache"""
+        path = self._cache_path(text)
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            np.save(f, vector)
+        os.replace(tmp_path, path)
+
     def create_embeddings(self, texts: List[str]) -> np.ndarray:
         """Create embeddings for a list of texts"""
         try:
-            # Get embeddings from Gemini
-            embeddings = self.embeddings.embed_documents(texts)
-
-            # Convert to numpy array
-            embeddings_array = np.array(embeddings, dtype=np.float32)
+            vectors, misses = self._load_or_miss(texts)
+
+            # Get embeddings from Gemini for cache misses only
+            if misses:
+                # Send batches concurrently on the shared pool
+                miss_texts = [texts[i] for i in misses]
+                batches = [
+                    miss_texts[start:start + EMBEDDING_BATCH_SIZE]
+                    for start in range(0, len(miss_texts), EMBEDDING_BATCH_SIZE)
+                ]
+                new_embeddings = itertools.chain.from_iterable(
+                    self._embed_pool.map(self.embeddings.embed_documents, batches)
+                )
+
+                for i, embedding in zip(misses, new_embeddings):
+                    vector = np.asarray(embedding, dtype=np.float32)
+                    self._save_vector(texts[i], vector)
+                    vectors[i] = vector
+
+            # Fill a preallocated (N, D) buffer row by row
+            dimension = len(vectors[0]) if vectors else 0
+            embeddings_array = np.empty((len(vectors), dimension), dtype=np.float32)
+            for i, vector in enumerate(vectors):
+                embeddings_array[i] = vector
 
             return embeddings_array
 
@@ -35,21 +128,28 @@ class EmbeddingService:
     def create_faiss_index(self, embeddings: np.ndarray) -> faiss.Index:
         """Create and train a FAISS index"""
         try:
-            dimension = embeddings.shape[1]
+            num_vectors, dimension = embeddings.shape
+
+            # Normalize so inner product equals cosine similarity
+            faiss.normalize_L2(embeddings)
 
-            # Use IndexFlatL2 for exact search (suitable for smaller datasets)
-            # For larger datasets, consider IndexIVFFlat
-            if len(embeddings) > 10000:
-                # Use IVF index for larger datasets
-                nlist = min(100, len(embeddings) // 10)  # Number of clusters
-                quantizer = faiss.IndexFlatL2(dimension)
-                index = faiss.IndexIVFFlat(quantizer, dimension, nlist)
+            if num_vectors > 10000 and dimension % 8 == 0:
+                # Use IVF index with PQ compression for larger datasets
+                nlist = max(4, int(4 * np.sqrt(num_vectors)))  # Number of clusters
+                quantizer = faiss.IndexFlatIP(dimension)
+                index = faiss.IndexIVFPQ(
+                    quantizer, dimension, nlist, dimension // 8, 8, faiss.METRIC_INNER_PRODUCT
+                )
 
                 # Train the index
                 index.train(embeddings)
+                index.nprobe = 8
             else:
-                # Use flat index for smaller datasets
-                index = faiss.IndexFlatL2(dimension)
+                # Use exhaustive search with vectors stored as float16
+                # (half the bytes scanned per query versus IndexFlatIP)
+                index = faiss.IndexScalarQuantizer(
+                    dimension, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_INNER_PRODUCT
+                )
 
             # Add vectors to index
             index.add(embeddings)
@@ -62,39 +162,79 @@ class EmbeddingService:
     def save_index(self, index: faiss.Index, index_path: str):
         """Save FAISS index to disk"""
         try:
-            faiss.write_index(index, index_path)
+            # Unique temp file per writer, so concurrent builds never share one
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(index_path) or ".", suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(faiss.serialize_index(index).tobytes())
+            os.replace(tmp_path, index_path)
         except Exception as e:
             raise Exception(f"Error saving FAISS index: {str(e)}")
 
     def load_index(self, index_path: str) -> faiss.Index:
         """Load FAISS index from disk"""
         try:
-            if os.path.exists(index_path):
-                return faiss.read_index(index_path)
-            return None
+            try:
+                # Read the whole file in one call, then deserialize from memory
+                with open(index_path, "rb") as f:
+                    data = f.read()
+            except FileNotFoundError:
+                return None
+            return faiss.deserialize_index(np.frombuffer(data, dtype=np.uint8))
         except Exception as e:
             raise Exception(f"Error loading FAISS index: {str(e)}")
 
-    def build_vector_store(self, chunks: List[str], course_code: str) -> faiss.Index:
-        """Build complete vector store for a course"""
-        try:
+    def _store_key(self, chunk_hashes: List[str], course_code: str) -> str:
+        """Get the cache key for a course's chunks from their hashes"""
+        # Hex digests are fixed width, so concatenating them is unambiguous
+        digest = hashlib.sha256("".join(chunk_hashes).encode("ascii"))
+        return f"{course_code}_{digest.hexdigest()[:16]}_{self.model_tag}_{INDEX_VERSION}"
+
+    def _load_vector_store(self, chunks: List[str], course_code: str, chunk_hashes: Optional[List[str]] = None) -> Tuple[faiss.Index, List[str]]:
+        """Load a course's vector store from memory or disk, building it if missing"""
+        if chunk_hashes is None:
+            chunk_hashes = [chunk_hash(chunk) for chunk in chunks]
+        key = self._store_key(chunk_hashes, course_code)
+        stored = self._stores.get(course_code)
+        if stored is not None and stored[0] == key:
+            return stored[1], stored[2]
+
+        index_path = os.path.join(settings.CACHE_DIR, f"{key}.faiss")
+        chunks_path = os.path.join(settings.CACHE_DIR, f"{key}.json")
+
+        index = self.load_index(index_path)
+        if index is not None and os.path.exists(chunks_path):
+            with open(chunks_path, "rb") as f:
+                chunks = orjson.loads(f.read())
+        else:
             # Create embeddings
-            print(f"Creating embeddings for {len(chunks)} chunks...")
+            logger.info("Creating embeddings for %d chunks...", len(chunks))
             embeddings = self.create_embeddings(chunks)
 
             # Create FAISS index
-            print("Creating FAISS index...")
+            logger.info("Creating FAISS index...")
             index = self.create_faiss_index(embeddings)
 
             # Save index and chunks for this course
-            index_path = f"faiss_index_{course_code}.bin"
             self.save_index(index, index_path)
+            fd, tmp_path = tempfile.mkstemp(dir=settings.CACHE_DIR, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(orjson.dumps(chunks))
+            os.replace(tmp_path, chunks_path)
+
+            logger.info("Vector store built successfully for course %s", course_code)
+
+        self._stores[course_code] = (key, index, chunks)
+        return index, chunks
+
+    def build_vector_store(self, chunks: List[str], course_code: str) -> faiss.Index:
+        """Build complete vector store for a course"""
+        try:
+            index, chunks = self._load_vector_store(chunks, course_code)
 
             # Store chunks for retrieval
             self.chunks = chunks
             self.index = index
 
-            print(f"Vector store built successfully for course {course_code}")
             return index
 
         except Exception as e:
@@ -107,8 +247,9 @@ class EmbeddingService:
                 raise ValueError("Vector store not initialized")
 
             # Create embedding for query
-            query_embedding = self.embeddings.embed_query(query)
+            query_embedding = self._embed_query(query)
             query_vector = np.array([query_embedding], dtype=np.float32)
+            faiss.normalize_L2(query_vector)
 
             # Search in FAISS index
             distances, indices = self.index.search(query_vector, k)
@@ -124,37 +265,40 @@ class EmbeddingService:
         except Exception as e:
             raise Exception(f"Error performing similarity search: {str(e)}")
 
-    def get_relevant_context(self, course_content_chunks: List[str], num_questions: int) -> List[str]:
+    def get_query_matrix(self) -> np.ndarray:
+        """Get the embedding matrix for the context queries"""
+        if self._query_matrix is None:
+            # Single batched call, backed by the on-disk embedding cache
+            query_matrix = self.create_embeddings(CONTEXT_QUERIES)
+            faiss.normalize_L2(query_matrix)
+            self._query_matrix = query_matrix
+        return self._query_matrix
+
+    def get_relevant_context(self, course_content_chunks: List[str], num_questions: int, course_code: str, chunk_hashes: Optional[List[str]] = None) -> List[str]:
         """Get relevant context for MCQ generation"""
         try:
-            # Build vector store if not exists
-            if self.index is None:
-                self.build_vector_store(course_content_chunks, "temp")
+            # Load (or build) the vector store for this course
+            index, chunks = self._load_vector_store(course_content_chunks, course_code, chunk_hashes)
 
-            # Create diverse queries to get comprehensive context
-            queries = [
-                "key concepts and definitions",
-                "important topics and theories", 
-                "main principles and methods",
-                "fundamental concepts",
-                "important examples and applications"
-            ]
+            # Search all queries in one batch
+            distances, indices = index.search(self.get_query_matrix(), 3)
 
-            relevant_chunks = set()
-
-            # Get relevant chunks for each query
-            for query in queries:
-                chunks = self.similarity_search(query, k=3)
-                relevant_chunks.update(chunks)
+            # Deduplicate chunk indices before materializing chunk strings
+            ids = np.unique(indices.ravel())
+            ids = ids[(ids >= 0) & (ids < len(chunks))]
+            relevant_ids = ids.tolist()
 
             # Ensure we have enough context
-            if len(relevant_chunks) < num_questions * 2:
+            if len(relevant_ids) < num_questions * 2:
                 # Add more random chunks to ensure sufficient context
-                remaining_chunks = [chunk for chunk in course_content_chunks if chunk not in relevant_chunks]
-                additional_needed = max(0, (num_questions * 3) - len(relevant_chunks))
-                relevant_chunks.update(remaining_chunks[:additional_needed])
-
-            return list(relevant_chunks)
+                seen = bytearray(len(chunks))
+                for i in relevant_ids:
+                    seen[i] = 1
+                remaining_ids = (i for i in range(len(chunks)) if not seen[i])
+                additional_needed = max(0, (num_questions * 3) - len(relevant_ids))
+                relevant_ids.extend(itertools.islice(remaining_ids, additional_needed))
+
+            return [chunks[i] for i in relevant_ids]
 
         except Exception as e:
             raise Exception(f"Error getting relevant context: {str(e)}")
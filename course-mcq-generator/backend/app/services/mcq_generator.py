@@ -1,34 +1,48 @@
-import json
 import re
-from typing import List, Dict, Any
+import logging
+import functools
+import orjson
+import tiktoken
+from pydantic import ValidationError
+from typing import List, Dict, Any, Tuple
 from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain.schema import HumanMessage, SystemMessage
 from app.core.config import settings
 from app.models.schemas import MCQ, MCQOption
 
-class MCQGenerator:
-    def __init__(self):
-        """Initialize the MCQ generator with Gemini LLM"""
-        if not settings.GOOGLE_API_KEY:
-            raise ValueError("GOOGLE_API_KEY not found in environment variables")
+logger = logging.getLogger(__name__)
 
-        self.llm = ChatGoogleGenerativeAI(
-            model=settings.GEMINI_MODEL,
-            google_api_key=settings.GOOGLE_API_KEY,
-            temperature=0.7,
-            max_tokens=4000
-        )
+# Patterns used when parsing LLM responses
+SPLIT_RE = re.compile(r'\n\s*(?:Question )?\d+[.:]')
+OPTION_RE = re.compile(r'^([A-D])[.)]\s*(.*)')
+PREFIX_RE = re.compile(r'^(Answer|Explanation|Correct):\s*(.*)')
+ANSWER_RE = re.compile(r'([A-D])')
 
-    def create_mcq_prompt(self, context: str, num_questions: int) -> str:
-        """Create a prompt for MCQ generation"""
-        prompt = f"""
-You are an expert educational content creator. Generate {num_questions} high-quality multiple-choice questions based on the following course material.
+# Maximum number of context chunks per prompt
+MAX_CONTEXT_CHUNKS = 10
+
+@functools.lru_cache(maxsize=1)
+def get_encoding() -> tiktoken.Encoding:
+    """Get the tokenizer used to budget prompt context"""
+    return tiktoken.get_encoding("cl100k_base")
+
+@functools.lru_cache(maxsize=4096)
+def count_tokens(text: str) -> int:
+    """Count tokens in a text (memoized since chunks recur across requests)"""
+    return len(get_encoding().encode(text))
+
+# Prompt template split around the course material so the context is never
+# passed through str.format
+_PROMPT_HEAD = """
+You are an expert educational content creator. Generate {n} high-quality multiple-choice questions based on the following course material.
 
 COURSE MATERIAL:
-{context}
+"""
+
+_PROMPT_TAIL = """
 
 INSTRUCTIONS:
-1. Generate exactly {num_questions} multiple-choice questions
+1. Generate exactly {n} multiple-choice questions
 2. Each question should have exactly 4 options (A, B, C, D)
 3. Only ONE option should be correct
 4. Questions should test understanding, not just memorization
@@ -56,25 +70,41 @@ REQUIRED JSON FORMAT:
 
 Generate the questions now:
 """
-        return prompt
+
+SYS_MSG = SystemMessage(content="You are an expert educational content creator specialized in creating high-quality multiple-choice questions.")
+
+class MCQGenerator:
+    def __init__(self):
+        """Initialize the MCQ generator with Gemini LLM"""
+        if not settings.GOOGLE_API_KEY:
+            raise ValueError("GOOGLE_API_KEY not found in environment variables")
+
+        self.llm = ChatGoogleGenerativeAI(
+            model=settings.GEMINI_MODEL,
+            google_api_key=settings.GOOGLE_API_KEY,
+            temperature=0.7,
+            max_tokens=4000
+        )
+
+    def create_mcq_prompt(self, context: str, num_questions: int) -> str:
+        """Create a prompt for MCQ generation"""
+        return _PROMPT_HEAD.format(n=num_questions) + context + _PROMPT_TAIL.format(n=num_questions)
 
     def parse_mcq_response(self, response_text: str) -> List[Dict[str, Any]]:
         """Parse the LLM response to extract MCQ data"""
         try:
-            # Try to find JSON in the response
-            json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
-            if json_match:
-                json_str = json_match.group()
-                data = json.loads(json_str)
-                return data.get("questions", [])
-
-            # If no JSON found, try to parse the entire response
-            try:
-                data = json.loads(response_text.strip())
-                return data.get("questions", [])
-            except json.JSONDecodeError:
-                # Fallback: extract questions manually
-                return self.manual_parse_questions(response_text)
+            # Try to find JSON in the response (first '{' to last '}')
+            start = response_text.find('{')
+            end = response_text.rfind('}')
+            if start != -1 and end > start:
+                try:
+                    data = orjson.loads(response_text[start:end + 1])
+                    return data.get("questions", [])
+                except orjson.JSONDecodeError:
+                    pass
+
+            # Fallback: extract questions manually
+            return self.manual_parse_questions(response_text)
 
         except Exception as e:
             raise Exception(f"Error parsing MCQ response: {str(e)}")
@@ -84,7 +114,7 @@ Generate the questions now:
         questions = []
 
         # Split by question numbers or patterns
-        question_parts = re.split(r'\n\s*(?:Question )?\d+[.:]', text)
+        question_parts = SPLIT_RE.split(text)
 
         for i, part in enumerate(question_parts[1:], 1):  # Skip first empty part
             try:
@@ -112,24 +142,27 @@ Generate the questions now:
                 continue
 
             # Check if it's an option
-            if re.match(r'^[A-D][.)]', line):
-                option_match = re.match(r'^([A-D])[.)]\s*(.+)', line)
-                if option_match:
-                    option_id = option_match.group(1)
-                    option_text = option_match.group(2)
+            option_match = OPTION_RE.match(line)
+            if option_match:
+                option_id, option_text = option_match.groups()
+                if option_text:
                     options.append({
                         "option_id": option_id,
                         "text": option_text,
                         "is_correct": False
                     })
-            elif not question and not line.startswith(('Answer:', 'Explanation:', 'Correct:')):
-                question = line
-            elif line.startswith(('Answer:', 'Correct:')):
-                correct_match = re.search(r'([A-D])', line)
+                continue
+
+            prefix_match = PREFIX_RE.match(line)
+            if not prefix_match:
+                if not question:
+                    question = line
+            elif prefix_match.group(1) == 'Explanation':
+                explanation = prefix_match.group(2).strip()
+            else:
+                correct_match = ANSWER_RE.search(prefix_match.group(2))
                 if correct_match:
                     correct_answer = correct_match.group(1)
-            elif line.startswith('Explanation:'):
-                explanation = line.replace('Explanation:', '').strip()
 
         # Mark correct option
         for option in options:
@@ -163,25 +196,13 @@ Generate the questions now:
                     continue
 
                 # Create MCQOption objects
-                mcq_options = []
-                correct_count = 0
-
-                for option in options:
-                    if not all(key in option for key in ["option_id", "text", "is_correct"]):
-                        continue
-
-                    mcq_option = MCQOption(
-                        option_id=option["option_id"],
-                        text=option["text"],
-                        is_correct=option["is_correct"]
-                    )
-                    mcq_options.append(mcq_option)
-
-                    if option["is_correct"]:
-                        correct_count += 1
+                try:
+                    mcq_options = [MCQOption.model_validate(option) for option in options]
+                except ValidationError:
+                    continue
 
                 # Ensure exactly one correct answer
-                if correct_count != 1 or len(mcq_options) != 4:
+                if sum(option.is_correct for option in mcq_options) != 1:
                     continue
 
                 # Create MCQ object
@@ -196,31 +217,48 @@ Generate the questions now:
                 validated_mcqs.append(mcq)
 
             except Exception as e:
-                print(f"Error validating MCQ {i}: {str(e)}")
+                logger.warning("Error validating MCQ %d: %s", i, e)
                 continue
 
         return validated_mcqs
 
-    def generate_mcqs(self, context: List[str], num_questions: int) -> List[MCQ]:
+    def combine_context(self, chunks: List[str]) -> Tuple[str, int]:
+        """Join chunks within the token budget, returning the text and chunks used"""
+        budget = settings.MAX_INPUT_TOKENS
+        selected = []
+        used_tokens = 0
+
+        for chunk in chunks[:MAX_CONTEXT_CHUNKS]:
+            # Separator tokens are negligible next to the chunks themselves
+            chunk_tokens = count_tokens(chunk)
+            if used_tokens + chunk_tokens > budget:
+                break
+            selected.append(chunk)
+            used_tokens += chunk_tokens
+
+        if not selected and chunks:
+            # A single chunk over budget: truncate it on a token boundary
+            encoding = get_encoding()
+            return encoding.decode(encoding.encode(chunks[0])[:budget]) + "...", 1
+
+        return "\n\n".join(selected), len(selected)
+
+    async def generate_mcqs(self, context: List[str], num_questions: int) -> List[MCQ]:
         """Generate MCQs from course content"""
         try:
-            # Combine context chunks
-            combined_context = "\n\n".join(context[:10])  # Use first 10 chunks to avoid token limits
-
-            # Truncate if too long (rough estimate for token limit)
-            if len(combined_context) > 15000:
-                combined_context = combined_context[:15000] + "..."
+            # Combine context chunks within the input token budget
+            combined_context, used_chunks = self.combine_context(context)
 
             # Create prompt
             prompt = self.create_mcq_prompt(combined_context, num_questions)
 
             # Generate response
             messages = [
-                SystemMessage(content="You are an expert educational content creator specialized in creating high-quality multiple-choice questions."),
+                SYS_MSG,
                 HumanMessage(content=prompt)
             ]
 
-            response = self.llm(messages)
+            response = await self.llm.ainvoke(messages)
             response_text = response.content
 
             # Parse response
@@ -231,21 +269,19 @@ Generate the questions now:
 
             # If we don't have enough valid MCQs, try to generate more
             if len(validated_mcqs) < num_questions:
-                print(f"Only {len(validated_mcqs)} valid MCQs generated, expected {num_questions}")
+                logger.info("Only %d valid MCQs generated, expected %d", len(validated_mcqs), num_questions)
 
                 # Try with different context if we have more chunks
-                if len(context) > 10:
-                    additional_context = "\n\n".join(context[10:20])
-                    if len(additional_context) > 15000:
-                        additional_context = additional_context[:15000] + "..."
+                if len(context) > used_chunks:
+                    additional_context, _ = self.combine_context(context[used_chunks:])
 
                     additional_prompt = self.create_mcq_prompt(additional_context, num_questions - len(validated_mcqs))
                     additional_messages = [
-                        SystemMessage(content="You are an expert educational content creator specialized in creating high-quality multiple-choice questions."),
+                        SYS_MSG,
                         HumanMessage(content=additional_prompt)
                     ]
 
-                    additional_response = self.llm(additional_messages)
+                    additional_response = await self.llm.ainvoke(additional_messages)
                     additional_mcq_data = self.parse_mcq_response(additional_response.content)
                     additional_validated_mcqs = self.validate_mcq_data(additional_mcq_data)
 
@@ -1,108 +1,543 @@
 import os
+import mmap
+import asyncio
+import hashlib
+import functools
+import tempfile
+import threading
+import multiprocessing
+import orjson
 import fitz  # PyMuPDF
-import pdfplumber
-from typing import List, Optional
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from contextlib import contextmanager, ExitStack
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 from app.core.config import settings
 
+try:
+    import pymupdf4llm
+except ImportError:  # Optional: fused Markdown extraction and page chunking
+    pymupdf4llm = None
+
+try:
+    import pyarrow as pa
+except ImportError:  # Optional: contiguous chunk arrays for batch consumers
+    pa = None
+
+# Bumped whenever extraction or chunking output changes, invalidating cached chunks
+CHUNK_CACHE_VERSION = "v4"
+
+# Single-character separators chunks may end on ("\n\n" ends with "\n")
+SEPARATORS = ("\n", " ")
+
+# PyMuPDF text flags: expand ligatures, normalize whitespace, and join
+# words hyphenated across line breaks
+TEXT_FLAGS = fitz.TEXT_DEHYPHENATE | fitz.TEXT_MEDIABOX_CLIP
+
+# Render resolution for OCR; 200 dpi balances accuracy and speed
+OCR_DPI = 200
+
+# Minimum pages per worker before PyMuPDF extraction is spread across processes
+PAGES_PER_WORKER = 32
+
+# Seconds the shared worker processes stay alive without a job
+PROCESS_POOL_IDLE_SECONDS = 60.0
+
+class EncryptedPDFError(ValueError):
+    """Raised when a PDF needs a password to be read"""
+
+class ScannedPDFError(ValueError):
+    """Raised when a PDF has no extractable text layer"""
+
+def _extract_page_range(args: Tuple[str, int, int]) -> List[str]:
+    """Extract text from a range of pages in a worker process"""
+    # MuPDF is not thread-safe, so each worker opens its own document
+    pdf_path, start, stop = args
+    with fitz.open(pdf_path) as doc:
+        return [doc[page_num].get_text("text", flags=TEXT_FLAGS) for page_num in range(start, stop)]
+
+def _ocr_page(args: Tuple[str, int, str]) -> str:
+    """OCR a single page with Tesseract in a worker process"""
+    pdf_path, page_num, language = args
+    with fitz.open(pdf_path) as doc:
+        page = doc[page_num]
+        textpage = page.get_textpage_ocr(language=language, dpi=OCR_DPI, full=True)
+        return page.get_text("text", textpage=textpage)
+
+# Worker processes shared by PyMuPDF extraction and OCR, created on first use
+# and stopped again once idle
+_process_pool: Optional[ProcessPoolExecutor] = None
+_process_pool_users = 0
+_process_pool_timer: Optional[threading.Timer] = None
+_process_pool_lock = threading.Lock()
+
+def process_pool_size() -> int:
+    """Get the number of PDF worker processes for this server process"""
+    if settings.PDF_WORKERS > 0:
+        return settings.PDF_WORKERS
+
+    # Split the cores across server processes instead of giving each
+    # one a pool as large as the machine
+    cpus = os.cpu_count() or 1
+    server_workers = settings.WEB_CONCURRENCY or (cpus * 2 + 1 if settings.ENV == "prod" else 1)
+    return max(1, cpus // server_workers)
+
+def shutdown_process_pool():
+    """Stop the shared worker processes, if any were started"""
+    global _process_pool, _process_pool_timer
+    with _process_pool_lock:
+        pool, _process_pool = _process_pool, None
+        timer, _process_pool_timer = _process_pool_timer, None
+    if timer is not None:
+        timer.cancel()
+    if pool is not None:
+        pool.shutdown()
+
+def _shutdown_idle_process_pool():
+    """Stop the shared worker processes if no job used them since the timer started"""
+    global _process_pool, _process_pool_timer
+    with _process_pool_lock:
+        # A newer job may have claimed the pool or restarted the timer
+        if _process_pool_users or threading.current_thread() is not _process_pool_timer:
+            return
+        pool, _process_pool = _process_pool, None
+        _process_pool_timer = None
+    if pool is not None:
+        pool.shutdown()
+
+def _map_in_pool(fn, items: List[Any]) -> List[Any]:
+    """Map a function over items on the shared process pool"""
+    global _process_pool, _process_pool_users, _process_pool_timer
+    with _process_pool_lock:
+        if _process_pool_timer is not None:
+            _process_pool_timer.cancel()
+            _process_pool_timer = None
+        if _process_pool is None:
+            # Spawned rather than forked, since the server process already runs
+            # threads (embedding pool, log listener) that fork would copy
+            # mid-operation. Spawned workers also start on demand, so a job
+            # never starts more processes than it submits tasks
+            _process_pool = ProcessPoolExecutor(
+                max_workers=process_pool_size(),
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        pool = _process_pool
+        _process_pool_users += 1
+
+    try:
+        return list(pool.map(fn, items))
+    except BrokenProcessPool:
+        # A crashed worker breaks the pool for good; replace it on next use
+        with _process_pool_lock:
+            if _process_pool is pool:
+                _process_pool = None
+        pool.shutdown(wait=False)
+        raise
+    finally:
+        with _process_pool_lock:
+            _process_pool_users -= 1
+            if not _process_pool_users and _process_pool is not None:
+                _process_pool_timer = threading.Timer(PROCESS_POOL_IDLE_SECONDS, _shutdown_idle_process_pool)
+                _process_pool_timer.daemon = True
+                _process_pool_timer.start()
+
+def chunk_hash(chunk: str) -> str:
+    """Hash a chunk's text with an 8-byte length prefix"""
+    # Stored with the chunks in the cache, so consumers such as the vector
+    # store cache key never need to re-hash chunk text
+    data = chunk.encode("utf-8")
+    digest = hashlib.sha256()
+    digest.update(len(data).to_bytes(8, "little"))
+    digest.update(data)
+    return digest.hexdigest()
+
+@functools.lru_cache(maxsize=1024)
+def _scan_course_dir(course_dir: str, mtime_ns: int) -> Optional[str]:
+    """Find the first PDF in a course directory (cached per directory mtime)"""
+    try:
+        entries = os.scandir(course_dir)
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+    with entries:
+        for entry in entries:
+            # DirEntry caches the joined path and the file type from readdir
+            if entry.name[-4:].lower() == '.pdf' and entry.is_file():
+                return entry.path
+
+    return None
+
 class PDFProcessor:
-    def __init__(self):
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=settings.CHUNK_SIZE,
-            chunk_overlap=settings.CHUNK_OVERLAP,
-            length_function=len,
-            separators=["\n\n", "\n", " ", ""]
-        )
+    def __init__(self, cache_dir: Optional[str] = None):
+        self.chunk_size = settings.CHUNK_SIZE
+        self.chunk_overlap = settings.CHUNK_OVERLAP
+
+        # Content-addressable cache of extracted text and chunks
+        self.cache_dir = os.path.join(cache_dir or settings.CACHE_DIR, "pdf")
+        os.makedirs(self.cache_dir, exist_ok=True)
 
     def find_course_pdf(self, course_code: str) -> Optional[str]:
         """Find the PDF file for a given course code"""
         course_dir = os.path.join(settings.COURSE_PDF_DIR, course_code)
 
-        if not os.path.exists(course_dir):
+        try:
+            # Adding or removing files changes the directory mtime,
+            # which invalidates the cached scan
+            mtime_ns = os.stat(course_dir).st_mtime_ns
+        except FileNotFoundError:
             return None
 
         # Look for PDF files in the course directory
-        for file in os.listdir(course_dir):
-            if file.lower().endswith('.pdf'):
-                return os.path.join(course_dir, file)
+        return _scan_course_dir(course_dir, mtime_ns)
 
-        return None
+    def clear_pdf_cache(self):
+        """Forget cached course PDF lookups"""
+        _scan_course_dir.cache_clear()
 
-    def extract_text_pymupdf(self, pdf_path: str) -> str:
-        """Extract text from PDF using PyMuPDF"""
+    @contextmanager
+    def open_doc(self, pdf_path: str) -> Iterator[fitz.Document]:
+        """Open a PDF once so several extraction passes can share it"""
+        doc = fitz.open(pdf_path)
         try:
-            doc = fitz.open(pdf_path)
-            text = ""
+            yield doc
+        finally:
+            doc.close()
 
-            for page_num in range(doc.page_count):
-                page = doc[page_num]
-                text += page.get_text()
-                text += "\n\n"  # Add page break
+    def extract_text_pymupdf(self, pdf_path: str, doc: Optional[fitz.Document] = None) -> str:
+        """Extract text from PDF using PyMuPDF, reusing an open document if given"""
+        try:
+            with ExitStack() as stack:
+                if doc is None:
+                    doc = stack.enter_context(self.open_doc(pdf_path))
 
-            doc.close()
-            return text.strip()
+                page_count = doc.page_count
+                workers = min(process_pool_size(), page_count // PAGES_PER_WORKER)
+
+                if workers > 1:
+                    # Split pages into one contiguous range per worker
+                    step = -(-page_count // workers)
+                    ranges = [
+                        (pdf_path, start, min(start + step, page_count))
+                        for start in range(0, page_count, step)
+                    ]
+                    parts = [text for texts in _map_in_pool(_extract_page_range, ranges) for text in texts]
+                else:
+                    parts = []
+
+                    for page in doc:
+                        parts.append(page.get_text("text", flags=TEXT_FLAGS))
+
+            return "\n\n".join(parts).strip()  # Page breaks between pages
 
         except Exception as e:
             raise Exception(f"Error extracting text with PyMuPDF: {str(e)}")
 
+    def extract_text_ocr(self, pdf_path: str, language: str = "eng") -> str:
+        """Extract text from a scanned PDF with Tesseract OCR, one page per worker"""
+        try:
+            with self.open_doc(pdf_path) as doc:
+                page_count = doc.page_count
+
+            # One task per page, so at most page_count workers are started
+            pages = [(pdf_path, page_num, language) for page_num in range(page_count)]
+            parts = _map_in_pool(_ocr_page, pages)
+
+            return "\n\n".join(parts).strip()  # Page breaks between pages
+
+        except Exception as e:
+            raise Exception(f"Error extracting text with OCR: {str(e)}")
+
     def extract_text_pdfplumber(self, pdf_path: str) -> str:
         """Extract text from PDF using pdfplumber (fallback method)"""
+        # Imported lazily since this fallback is rarely used
+        import pdfplumber
+
         try:
-            text = ""
+            parts = []
             with pdfplumber.open(pdf_path) as pdf:
                 for page in pdf.pages:
                     page_text = page.extract_text()
                     if page_text:
-                        text += page_text
-                        text += "\n\n"
+                        parts.append(page_text)
 
-            return text.strip()
+            return "\n\n".join(parts).strip()
 
         except Exception as e:
             raise Exception(f"Error extracting text with pdfplumber: {str(e)}")
 
-    def extract_text(self, pdf_path: str) -> str:
+    def extract_text(self, pdf_path: str, doc: Optional[fitz.Document] = None) -> str:
         """Extract text from PDF using primary method with fallback"""
         if not os.path.exists(pdf_path):
             raise FileNotFoundError(f"PDF file not found: {pdf_path}")
 
-        try:
-            # Try PyMuPDF first
-            return self.extract_text_pymupdf(pdf_path)
-        except Exception:
-            # Fallback to pdfplumber
-            return self.extract_text_pdfplumber(pdf_path)
+        with ExitStack() as stack:
+            if doc is None:
+                try:
+                    doc = stack.enter_context(self.open_doc(pdf_path))
+                except Exception:
+                    doc = None
+
+            # Neither extractor can read a password-protected PDF
+            if doc is not None and doc.needs_pass:
+                raise EncryptedPDFError(f"PDF is password protected: {pdf_path}")
+
+            try:
+                # Try PyMuPDF first
+                text = self.extract_text_pymupdf(pdf_path, doc)
+            except Exception:
+                # Fallback to pdfplumber
+                return self.extract_text_pdfplumber(pdf_path)
+
+        # PyMuPDF parsed every page but found no text layer; pdfplumber
+        # would only repeat the work, so leave it to an OCR path
+        if not text:
+            raise ScannedPDFError(f"PDF has no text layer: {pdf_path}")
+
+        return text
+
+    def split_text(self, text: str) -> Iterator[str]:
+        """Split text into overlapping windows of at most chunk_size characters
+
+        Each chunk ends after the last separator that fits in its window (or
+        is cut hard when none does), and the next chunk starts after the first
+        separator within chunk_overlap characters of that end.
+        """
+        length = len(text)
+        start = 0
+
+        while start < length:
+            limit = start + self.chunk_size
+            if limit >= length:
+                end = stop = length
+            else:
+                # str.rfind/find run as memchr-style scans in C
+                last = max(text.rfind(sep, start, limit) for sep in SEPARATORS)
+                if last >= start:
+                    end, stop = last + 1, last
+                else:
+                    end = stop = limit
+
+            # The separator is left out of the slice, so strip() only copies
+            # the chunk again when whitespace runs together
+            chunk = text[start:stop].strip()
+            if chunk:
+                yield chunk
+
+            if end >= length:
+                break
+
+            overlap_start = max(end - self.chunk_overlap - 1, 0)
+            found = [pos for pos in (text.find(sep, overlap_start, end) for sep in SEPARATORS) if pos != -1]
+            next_start = min(found) + 1 if found else end
+            start = next_start if start < next_start < end else end
+
+    def iter_chunks(self, text: str) -> Iterator[str]:
+        """Lazily yield manageable chunks of text"""
+        if not text or text.isspace():
+            raise ValueError("Empty text provided for chunking")
+
+        for chunk in self.split_text(text):
+            # Filter out very short chunks (already stripped by the splitter)
+            if len(chunk) > 50:
+                yield chunk
 
     def chunk_text(self, text: str) -> List[str]:
         """Split text into manageable chunks"""
-        if not text.strip():
-            raise ValueError("Empty text provided for chunking")
+        return list(self.iter_chunks(text))
 
-        chunks = self.text_splitter.split_text(text)
+    def chunk_text_arrow(self, text: str) -> "pa.StringArray":
+        """Split text into chunks held in one contiguous Arrow string array"""
+        if pa is None:
+            raise ImportError("pyarrow is required for Arrow chunk output")
 
-        # Filter out very short chunks
-        chunks = [chunk for chunk in chunks if len(chunk.strip()) > 50]
+        # pyarrow collects an iterable of unknown length into a list anyway,
+        # so build the list explicitly
+        return pa.array(self.chunk_text(text), type=pa.string())
 
-        return chunks
+    def extract_and_chunk_pymupdf4llm(self, pdf_path: str, doc: Optional[fitz.Document] = None) -> Tuple[str, List[str]]:
+        """Extract Markdown per page with PyMuPDF4LLM and chunk on page boundaries"""
+        try:
+            pages = pymupdf4llm.to_markdown(doc if doc is not None else pdf_path, page_chunks=True)
+            texts = [page["text"].strip() for page in pages]
+            chunks = []
 
-    def process_course_pdf(self, course_code: str) -> List[str]:
-        """Complete processing pipeline for a course PDF"""
+            for page_text in texts:
+                # Filter out very short pages
+                if len(page_text) <= 50:
+                    continue
+
+                # Only split pages that exceed the chunk size
+                if len(page_text) > self.chunk_size:
+                    chunks.extend(self.chunk_text(page_text))
+                else:
+                    chunks.append(page_text)
+
+            return "\n\n".join(texts).strip(), chunks
+
+        except Exception as e:
+            raise Exception(f"Error extracting text with PyMuPDF4LLM: {str(e)}")
+
+    def _fingerprint(self, pdf_path: str) -> str:
+        """Compute the sha256 of a PDF file's bytes"""
+        with open(pdf_path, "rb") as f:
+            # Empty files cannot be memory-mapped
+            if os.fstat(f.fileno()).st_size == 0:
+                return hashlib.sha256().hexdigest()
+
+            # Hash the whole mapping in one C-level call
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                return hashlib.sha256(mapped).hexdigest()
+
+    def _cache_path(self, pdf_path: str) -> str:
+        """Get the chunk cache file path for a PDF"""
+        extractor = "md" if pymupdf4llm is not None else "text"
+        key = f"{self._fingerprint(pdf_path)}_{self.chunk_size}_{self.chunk_overlap}_{extractor}_{CHUNK_CACHE_VERSION}"
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _load_cache_entry(self, cache_path: str) -> Optional[Dict[str, Any]]:
+        """Load a cache entry, or None on a cache miss"""
+        try:
+            with open(cache_path, "rb") as f:
+                entry = orjson.loads(f.read())
+        except (FileNotFoundError, orjson.JSONDecodeError):
+            return None
+
+        if not entry.get("chunks"):
+            return None
+
+        if len(entry.get("hashes", ())) != len(entry["chunks"]):
+            entry["hashes"] = [chunk_hash(chunk) for chunk in entry["chunks"]]
+
+        return entry
+
+    def _save_cached(self, cache_path: str, text: str, chunks: List[str], hashes: List[str]):
+        """Atomically write extracted text, chunks and chunk hashes to the cache"""
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            f.write(orjson.dumps({"text": text, "chunks": chunks, "hashes": hashes}))
+        os.replace(tmp_path, cache_path)
+
+    def _extract_and_chunk(self, pdf_path: str, doc: Optional[fitz.Document] = None) -> Tuple[str, Iterator[str]]:
+        """Extract a PDF and lazily chunk it, preferring PyMuPDF4LLM when installed"""
+        # Checked up front so no extractor can bypass it
+        if doc is not None and doc.needs_pass:
+            raise EncryptedPDFError(f"PDF is password protected: {pdf_path}")
+
+        if pymupdf4llm is not None:
+            try:
+                text, chunks = self.extract_and_chunk_pymupdf4llm(pdf_path, doc)
+                # Scanned PDFs yield only near-empty pages; let extract_text
+                # detect them so they reach OCR
+                if chunks:
+                    return text, iter(chunks)
+            except Exception:
+                pass  # Fall back to plain text extraction and splitting
+
+        # Extract text, running OCR only for scanned PDFs
+        try:
+            text = self.extract_text(pdf_path, doc)
+        except ScannedPDFError:
+            text = self.extract_text_ocr(pdf_path)
+        if not text or text.isspace():
+            raise ValueError(f"No text content extracted from PDF: {pdf_path}")
+
+        # Chunk text as the caller consumes it
+        return text, self.iter_chunks(text)
+
+    def _process(self, course_code: str) -> Tuple[List[str], List[str]]:
+        """Run the processing pipeline, returning chunks and their hashes"""
         # Find PDF file
         pdf_path = self.find_course_pdf(course_code)
         if not pdf_path:
             raise FileNotFoundError(f"No PDF found for course: {course_code}")
 
-        # Extract text
-        text = self.extract_text(pdf_path)
-        if not text.strip():
-            raise ValueError(f"No text content extracted from PDF: {pdf_path}")
+        # Reuse cached chunks for unchanged PDF content
+        cache_path = self._cache_path(pdf_path)
+        entry = self._load_cache_entry(cache_path)
+        if entry:
+            return entry["chunks"], entry["hashes"]
+
+        hashed_chunks = list(self._iter_extracted(pdf_path, cache_path))
+        return [chunk for chunk, _ in hashed_chunks], [digest for _, digest in hashed_chunks]
+
+    def _iter_extracted(self, pdf_path: str, cache_path: str) -> Iterator[Tuple[str, str]]:
+        """Extract and chunk a PDF, yielding (chunk, hash) pairs and caching them once exhausted"""
+        # Parse the document once and share it across extraction passes;
+        # files MuPDF cannot open are left to the pdfplumber fallback
+        with ExitStack() as stack:
+            try:
+                doc = stack.enter_context(self.open_doc(pdf_path))
+            except Exception:
+                doc = None
+
+            # Extract text; chunks are split as they are consumed below
+            text, chunk_iter = self._extract_and_chunk(pdf_path, doc)
+
+        chunks = []
+        hashes = []
+        for chunk in chunk_iter:
+            digest = chunk_hash(chunk)
+            chunks.append(chunk)
+            hashes.append(digest)
+            yield chunk, digest
 
-        # Chunk text
-        chunks = self.chunk_text(text)
         if not chunks:
             raise ValueError(f"No valid chunks created from PDF: {pdf_path}")
 
+        self._save_cached(cache_path, text, chunks, hashes)
+
+    def process_course_pdf(self, course_code: str) -> List[str]:
+        """Complete processing pipeline for a course PDF"""
+        chunks, _ = self._process(course_code)
         return chunks
 
-# Initialize processor instance
-pdf_processor = PDFProcessor()
\ No newline at end of file
+    def process_course_pdf_hashed(self, course_code: str) -> List[Tuple[str, str]]:
+        """Processing pipeline returning (hash, text) pairs for cross-course dedup"""
+        chunks, hashes = self._process(course_code)
+        return list(zip(hashes, chunks))
+
+    def process_course_pdf_arrow(self, course_code: str) -> "pa.StringArray":
+        """Processing pipeline returning chunks as an Arrow string array"""
+        if pa is None:
+            raise ImportError("pyarrow is required for Arrow chunk output")
+
+        return pa.array(self.process_course_pdf(course_code), type=pa.string())
+
+    async def aprocess_course_pdf(self, course_code: str) -> List[str]:
+        """Run the processing pipeline off the event loop"""
+        return await asyncio.to_thread(self.process_course_pdf, course_code)
+
+    async def aprocess_course_pdf_hashed(self, course_code: str) -> List[Tuple[str, str]]:
+        """Run the hashed processing pipeline off the event loop"""
+        return await asyncio.to_thread(self.process_course_pdf_hashed, course_code)
+
+    def process_course_pdf_iter(self, course_code: str) -> Iterator[str]:
+        """Processing pipeline for a course PDF that yields chunks as they are split
+
+        On a cache miss the first chunk is available before splitting
+        finishes, and the chunks are cached once the iterator is exhausted.
+        Peak memory matches process_course_pdf, since the cache entry still
+        holds every chunk.
+        """
+        # Find PDF file
+        pdf_path = self.find_course_pdf(course_code)
+        if not pdf_path:
+            raise FileNotFoundError(f"No PDF found for course: {course_code}")
+
+        # Reuse cached chunks for unchanged PDF content
+        cache_path = self._cache_path(pdf_path)
+        entry = self._load_cache_entry(cache_path)
+        if entry:
+            return iter(entry["chunks"])
+
+        return (chunk for chunk, _ in self._iter_extracted(pdf_path, cache_path))
+
+# Processor instance, created on first use
+_instance: Optional[PDFProcessor] = None
+
+def get_pdf_processor() -> PDFProcessor:
+    """Get the shared processor instance, creating it on first use"""
+    global _instance
+    if _instance is None:
+        _instance = PDFProcessor()
+    return _instance
\ No newline at end of file